@@ -1,14 +1,9 @@
 import pandas as pd
-from retry_requests import retry
-from requests import Session
 import logging
+from ednaresults.worms import WormsClient
 
 
-retry_session = retry(Session(), retries=5, backoff_factor=2)
-
-
-def split_max_n(lst: list, n: int) -> list[list]:
-    return [lst[i * n:(i + 1) * n] for i in range((len(lst) + n - 1) // n)]
+worms_client = WormsClient()
 
 
 def get_lowest_level_id(row, columns, names_map):
@@ -26,27 +21,15 @@ def add_aphiaid(df: pd.DataFrame) -> pd.DataFrame:
     all_names = df[columns].values.ravel()
     distinct_names = pd.unique(all_names[~pd.isna(all_names)])
 
-    batches = split_max_n(distinct_names, 50)
     names_map = {}
 
-    logging.debug(f"Matching names at all levels ({len(batches)} batches)")
-
-    for i, batch in enumerate(batches):
-
-        logging.debug(f"Batch {i + 1} of {len(batches)}")
-
-        url = "https://www.marinespecies.org/rest/AphiaRecordsByMatchNames?marine_only=false&" + "&".join([f"scientificnames%5B%5D={name}" for name in batch])
-        res = retry_session.get(url)
-        res.raise_for_status()
-        if res.status_code == 204:
-            continue
-        aphia_records = res.json()
+    logging.debug(f"Matching {len(distinct_names)} names at all levels")
 
-        for i in range(len(batch)):
-            for record in aphia_records[i]:
-                if record["match_type"].startswith("exact"):
-                    names_map[batch[i]] = record["AphiaID"]
-                    break
+    for name, aphia_records in worms_client.match_names(list(distinct_names)).items():
+        for record in aphia_records:
+            if record["match_type"].startswith("exact"):
+                names_map[name] = record["AphiaID"]
+                break
 
     df["AphiaID"] = df.apply(get_lowest_level_id, axis=1, columns=columns, names_map=names_map)
     df["AphiaID"] = df["AphiaID"].fillna(12).astype(int)
@@ -58,26 +41,11 @@ def add_accepted_aphiaid(df: pd.DataFrame) -> pd.DataFrame:
     """Add a valid_AphiaID column to a dataframe with AphiaIDs."""
 
     aphiaids = [int(aphiaid) for aphiaid in set(df["AphiaID"])]
-    batches = split_max_n(aphiaids, 50)
-    accepted_aphiaids = dict()
-
-    logging.info(f"Fetching accepted AphiaIDs for all AphiaIDs ({len(batches)} batches)")
-
-    for i, batch in enumerate(batches):
-
-        logging.debug(f"Batch {i + 1} of {len(batches)}")
-
-        url = "https://www.marinespecies.org/rest/AphiaRecordsByAphiaIDs?" + "&".join([f"aphiaids%5B%5D={aphiaid}" for aphiaid in batch])
-        res = retry_session.get(url)
-        res.raise_for_status()
-        aphia_records = res.json()
 
-        aphia_map = {record["AphiaID"]: record["valid_AphiaID"] for record in aphia_records if record["valid_AphiaID"] is not None}
+    logging.info(f"Fetching accepted AphiaIDs for {len(aphiaids)} AphiaIDs")
 
-        accepted_aphiaids.update(aphia_map)
-
-        if "124454" in batch:  # and 124454 not in aphia_map:
-            print(aphia_map)
+    aphia_records = worms_client.records_by_aphiaids(aphiaids)
+    accepted_aphiaids = {aphiaid: record["valid_AphiaID"] for aphiaid, record in aphia_records.items() if record["valid_AphiaID"] is not None}
 
     # report on missing AphiaIDs
     missing_aphiaids = set(aphiaids) - set(accepted_aphiaids.keys())
@@ -86,7 +54,7 @@ def add_accepted_aphiaid(df: pd.DataFrame) -> pd.DataFrame:
         for aphiaid in missing_aphiaids:
             logging.warning(f"Missing valid AphiaID for: {aphiaid}")
 
-    df["valid_AphiaID"] = pd.Series([accepted_aphiaids.get(aphiaid, None) for aphiaid in df["AphiaID"]], dtype="Int64")
+    df["valid_AphiaID"] = pd.Series([accepted_aphiaids.get(aphiaid, None) for aphiaid in df["AphiaID"]], dtype="Int64", index=df.index)
     df["valid_AphiaID"] = df["valid_AphiaID"].fillna(df["AphiaID"])  # use original AphiaID if no accepted AphiaID is found
 
     return df
@@ -124,63 +92,77 @@ def add_accepted_aphiaid(df: pd.DataFrame) -> pd.DataFrame:
 #     return df
 
 
-def add_taxonomy(df: pd.DataFrame, as_dwc: bool = True) -> pd.DataFrame:
-    """Remove existing taxonomy columns and add taxonomy based on valid_AphiaID."""
+DWC_TAXON_COLUMNS = ["kingdom", "phylum", "class", "order", "family", "genus", "scientificName", "taxonRank"]
+LIST_TAXON_COLUMNS = ["kingdom", "phylum", "class", "order", "family", "genus", "species", "marine", "rank"]
+
+
+def taxon_fields(record: dict, as_dwc: bool = True) -> dict:
+    if record is None:
+        return {}
+    if as_dwc:
+        return {
+            "kingdom": record["kingdom"],
+            "phylum": record["phylum"],
+            "class": record["class"],
+            "order": record["order"],
+            "family": record["family"],
+            "genus": record["genus"],
+            "scientificName": record["scientificname"],
+            "taxonRank": record["rank"].lower() if record.get("rank") else None
+        }
+    else:
+        return {
+            "kingdom": record["kingdom"],
+            "phylum": record["phylum"],
+            "class": record["class"],
+            "order": record["order"],
+            "family": record["family"],
+            "genus": record["genus"],
+            "species": record["scientificname"],
+            "marine": record["isMarine"] != 0 or record["isBrackish"] != 0,
+            "rank": record["rank"].lower() if record.get("rank") else None
+        }
+
+
+def fetch_taxa(aphiaids: list, as_dwc: bool = True) -> pd.DataFrame:
+    """Fetch a taxonomy table with one row per AphiaID, indexed by AphiaID. Ranks are stored as categoricals.
+    AphiaIDs which are missing from the WoRMS response get empty taxonomy."""
+
+    logging.debug(f"Fetching taxonomy for {len(aphiaids)} AphiaIDs")
+
+    records = worms_client.records_by_aphiaids(aphiaids)
+
+    missing_aphiaids = [aphiaid for aphiaid in aphiaids if aphiaid not in records]
+    if missing_aphiaids:
+        logging.warning(f"Could not retrieve taxonomy for {len(missing_aphiaids)} AphiaIDs")
+        for aphiaid in missing_aphiaids:
+            logging.warning(f"Missing taxonomy for: {aphiaid}")
 
-    df = df.drop([col for col in ["kingdom", "phylum", "class", "order", "family", "genus", "scientificName", "taxonRank", "AphiaID"] if col in df.columns], axis=1)
+    columns = DWC_TAXON_COLUMNS if as_dwc else LIST_TAXON_COLUMNS
+    taxa = pd.DataFrame([taxon_fields(records.get(aphiaid), as_dwc) for aphiaid in aphiaids], columns=columns)
+    taxa.insert(0, "AphiaID", pd.array(aphiaids, dtype="Int64"))
+    taxa.index = pd.Index(aphiaids)
 
-    aphiaids = list(set(df["valid_AphiaID"]))
-    batches = split_max_n(aphiaids, 50)
+    for column in columns:
+        if column == "marine":
+            taxa[column] = taxa[column].astype("boolean")
+        else:
+            taxa[column] = pd.Categorical(taxa[column])
 
-    taxa = []
+    return taxa
 
-    logging.debug(f"Fetching taxonomy for all AphiaIDs ({len(batches)} batches)")
 
-    for i, batch in enumerate(batches):
+def add_taxonomy(df: pd.DataFrame, as_dwc: bool = True) -> pd.DataFrame:
+    """Remove existing taxonomy columns and add taxonomy based on valid_AphiaID. Taxonomy is fetched once per distinct
+    valid_AphiaID and attached as categoricals, so memory scales with the number of taxa rather than the number of rows."""
 
-        logging.debug(f"Batch {i + 1} of {len(batches)}")
+    df = df.drop([col for col in ["kingdom", "phylum", "class", "order", "family", "genus", "scientificName", "taxonRank", "AphiaID"] if col in df.columns], axis=1)
 
-        url = "https://www.marinespecies.org/rest/AphiaRecordsByAphiaIDs?" + "&".join([f"aphiaids%5B%5D={aphiaid}" for aphiaid in batch])
-        res = retry_session.get(url)
-        res.raise_for_status()
-        aphia_records = res.json()
+    aphiaids = [int(aphiaid) for aphiaid in df["valid_AphiaID"].dropna().unique()]
+    taxa = fetch_taxa(aphiaids, as_dwc)
 
-        if as_dwc:
-            records = [{
-                "AphiaID": record["AphiaID"],
-                "kingdom": record["kingdom"],
-                "phylum": record["phylum"],
-                "class": record["class"],
-                "order": record["order"],
-                "family": record["family"],
-                "genus": record["genus"],
-                "scientificName": record["scientificname"],
-                "taxonRank": record["rank"].lower() if record.get("rank") else None
-            } for record in aphia_records]
-        else:
-            records = [{
-                "AphiaID": record["AphiaID"],
-                "kingdom": record["kingdom"],
-                "phylum": record["phylum"],
-                "class": record["class"],
-                "order": record["order"],
-                "family": record["family"],
-                "genus": record["genus"],
-                "species": record["scientificname"],
-                "marine": record["isMarine"] != 0 or record["isBrackish"] != 0,
-                "rank": record["rank"].lower() if record.get("rank") else None
-            } for record in aphia_records]
-
-        assert len(records) == len(batch)
-        taxa.extend(records)
-
-        # TODO! fix for missing taxa, result set not same size as query
-
-    assert len(taxa) == len(aphiaids)
-
-    taxon_mapping = dict(zip(aphiaids, taxa))
-
-    taxa_df = pd.DataFrame([taxon_mapping[aphiaid] for aphiaid in df["valid_AphiaID"]])
-    df = pd.concat([df, taxa_df], axis=1)
+    positions = taxa.index.get_indexer(df["valid_AphiaID"])
+    for column in taxa.columns:
+        df[column] = pd.Series(taxa[column].array.take(positions, allow_fill=True), index=df.index)
 
     return df
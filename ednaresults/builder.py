@@ -0,0 +1,587 @@
+import os
+import pandas as pd
+from ednaresults import RESULTS_SOURCE
+from ednaresults.checkpoint import Checkpoints, file_fingerprint, fingerprint
+from ednaresults.export import CombinedExporter
+from ednaresults.inventory import Inventory
+from ednaresults.output import Archive, check_compression, output_path
+from ednaresults.pipeline import BackgroundWriter, Prefetcher
+from ednaresults.resolver import DatasetResolver
+from ednaresults.util import assign_values, read_sample_id_mapping, remap_sample_ids, remap_to_shared_categorical
+import json
+import urllib.request
+import logging
+import shutil
+
+
+class OccurrenceBuilder():
+
+    def __init__(
+        self,
+        project_names=["eDNAexpeditions_batch1_samples", "eDNAexpeditions_batch2_samples"],
+        occurrence_file="Occurrence_table.tsv",
+        dna_file="DNA_extension_table.tsv",
+        pipeline_data_path="./pipeline_data/",
+        output_folder="output",
+        remove_contaminants=True,
+        list_generator=None,
+        sync_results=True,
+        sample_id_mapping_file="supporting_data/sample_id_mapping.csv",
+        dataset_names_file=None,
+        inventory_file=None,
+        combined_database=None,
+        pipelined=False,
+        state_folder="state",
+        resume=False,
+        compression=None,
+        archive=True,
+        sites=None,
+        markers=None,
+        rescan=False,
+        results_source=RESULTS_SOURCE
+    ):
+        self.project_names = project_names
+        self.occurrence_file = occurrence_file
+        self.dna_file = dna_file
+        self.pipeline_data_path = pipeline_data_path
+        self.output_folder = output_folder
+        self.remove_contaminants = remove_contaminants
+        self.list_generator = list_generator
+        self.sync_results = sync_results
+        self.sample_id_mapping_file = sample_id_mapping_file
+        self.resolver = DatasetResolver(dataset_names_file)
+        self.combined_exporter = CombinedExporter(combined_database) if combined_database is not None else None
+        self.inventory = Inventory(pipeline_data_path, project_names, [occurrence_file, dna_file], inventory_file if inventory_file is not None else os.path.join(state_folder, "inventory.json"))
+        self.pipelined = pipelined
+        self.writer = None
+        self.checkpoints = Checkpoints(state_folder)
+        self.resume = resume
+        check_compression(compression)
+        self.compression = compression
+        self.archive = Archive(output_folder, compressed=compression is not None) if archive else None
+        self.sites = sites
+        self.markers = markers
+        self.rescan = rescan
+        self.results_source = results_source
+
+    @property
+    def partial(self) -> bool:
+        """Only a subset of sites or markers is processed, existing outputs and state of other sites are kept."""
+        return self.sites is not None or self.markers is not None
+
+    def build(self):
+
+        from termcolor import colored
+
+        if self.partial and self.combined_exporter is not None:
+            raise Exception("The combined database can only be written by a build of all sites")
+
+        # download pipeline results from GitHub
+
+        if self.sync_results:
+            self.download_results()
+
+        # scan pipeline_data or reuse the persisted inventory
+
+        self.inventory.load(self.rescan)
+
+        # resolve sites and markers for all datasets, fail early on unrecognized folders
+
+        datasets = self.filter_datasets(self.validate_datasets())
+
+        # fetch metadata from PlutoF and format
+
+        metadata_df = self.fetch_metadata_df()
+
+        # read sample ID remapping table
+
+        sample_id_mapping = self.read_sample_id_mapping()
+
+        # prepare output folder
+
+        self.prepare_output_folder(clear=not (self.resume or self.partial))
+        self.checkpoints.prepare(self.resume or self.partial)
+
+        if self.combined_exporter is not None:
+            self.combined_exporter.open()
+
+        # process by site
+
+        folders_by_site = self.get_folders_by_site(datasets)
+        markers = {dataset["folder"]: dataset["marker"] for dataset in datasets}
+
+        # tables rewritten in place are not picked up by the inventory, check them before trusting checkpoints
+
+        if self.resume:
+            self.inventory.refresh([folder for folders in folders_by_site.values() for folder in folders])
+        dataset_files = self.inventory.dataset_files()
+
+        # fingerprint stage inputs, skip sites which were finished in a previous run
+
+        metadata_hash = str(pd.util.hash_pandas_object(metadata_df, index=False).sum())
+        site_inputs = {}
+        output_inputs = {}
+
+        for site_name in list(folders_by_site):
+            site_inputs[site_name] = fingerprint({dataset: dataset_files[dataset] for dataset in folders_by_site[site_name]}, sample_id_mapping, metadata_hash)
+            output_inputs[site_name] = fingerprint(site_inputs[site_name], self.annotation_inputs(site_name), self.compression, self.list_inputs())
+
+            if self.resume and self.checkpoints.exists(site_name, "output", output_inputs[site_name]) and self.outputs_exist(site_name):
+                logging.info(f"Skipping {site_name}, finished in a previous run")
+                if self.combined_exporter is not None:
+                    _, _, occurrence_path, dna_path = self.site_output_paths(site_name)
+                    self.combined_exporter.add_site(site_name, pd.read_csv(occurrence_path, sep="\t"), pd.read_csv(dna_path, sep="\t"))
+                if self.archive is not None:
+                    self.archive.add(self.site_output_paths(site_name))
+                if self.list_generator is not None:
+                    self.list_generator.add_to_archive(site_name)
+                del folders_by_site[site_name]
+
+        if self.pipelined:
+            self.writer = BackgroundWriter()
+            if self.list_generator is not None:
+                self.list_generator.writer = self.writer
+            sites = Prefetcher(folders_by_site, lambda site_name: self.read_site(site_name, folders_by_site[site_name], markers, dataset_files))
+        else:
+            sites = ((site_name, self.read_site(site_name, folders_by_site[site_name], markers, dataset_files)) for site_name in folders_by_site)
+
+        sites = iter(sites)
+
+        try:
+            for site_name, tables in sites:
+
+                logging.info(colored(f"Processing {site_name} data", "green"))
+
+                if tables is None:
+                    logging.warn(f"Skipping {site_name} due to missing data")
+                    continue
+
+                occurrence_combined, dna_combined = tables
+
+                # remap sample IDs, store occurrenceIDs as categoricals with shared categories
+
+                occurrence_combined["materialSampleID"] = remap_sample_ids(occurrence_combined["materialSampleID"], sample_id_mapping)
+                occurrence_combined["occurrenceID"], dna_combined["occurrenceID"] = remap_to_shared_categorical(
+                    sample_id_mapping, occurrence_combined["occurrenceID"], dna_combined["occurrenceID"]
+                )
+
+                # merge metadata, move blanks into separate table
+
+                metadata_df_blank = metadata_df[metadata_df["blank"] == True]
+                metadata_df_notblank = metadata_df[metadata_df["blank"] == False]
+
+                occurrence_combined_blank = pd.merge(occurrence_combined, metadata_df_blank, on="materialSampleID", how="inner")
+                occurrence_combined_notblank = pd.merge(occurrence_combined, metadata_df_notblank, on="materialSampleID", how="inner")
+
+                # replace taxonomy
+
+                taxonomy_checkpoint = self.checkpoints.load(site_name, "taxonomy", site_inputs[site_name]) if self.resume else None
+                if taxonomy_checkpoint is not None:
+                    occurrence_combined_notblank = taxonomy_checkpoint
+                else:
+                    occurrence_combined_notblank = self.replace_taxonomy(occurrence_combined_notblank)
+                    self.checkpoints.save(site_name, "taxonomy", site_inputs[site_name], occurrence_combined_notblank)
+
+                # apply annotations
+
+                occurrence_combined_notblank = self.apply_annotations(occurrence_combined_notblank, site_name)
+
+                # cleanup dna tables
+
+                dna_combined_blank = dna_combined[dna_combined["occurrenceID"].isin(occurrence_combined_blank["occurrenceID"])]
+                dna_combined_notblank = dna_combined[dna_combined["occurrenceID"].isin(occurrence_combined_notblank["occurrenceID"])]
+
+                # remove singletons from non blank data
+
+                read_counts = pd.merge(
+                    occurrence_combined_notblank[["occurrenceID", "organismQuantity"]],
+                    dna_combined_notblank[["occurrenceID", "DNA_sequence"]],
+                    on="occurrenceID"
+                ).groupby("DNA_sequence", as_index=False).agg({"organismQuantity": "sum"})
+                singletons = read_counts[read_counts["organismQuantity"] == 1]
+                singleton_ids = dna_combined_notblank[dna_combined_notblank["DNA_sequence"].isin(singletons["DNA_sequence"])]["occurrenceID"]
+
+                occurrence_combined_notblank = occurrence_combined_notblank[~occurrence_combined_notblank["occurrenceID"].isin(singleton_ids)]
+                dna_combined_notblank = dna_combined_notblank[~dna_combined_notblank["occurrenceID"].isin(singleton_ids)]
+
+                # remove all A or all C
+
+                all_ac_ids = dna_combined_notblank[dna_combined_notblank["DNA_sequence"].str.fullmatch(r"[AC]+")]["occurrenceID"].tolist()
+                occurrence_combined_notblank = occurrence_combined_notblank[~occurrence_combined_notblank["occurrenceID"].isin(all_ac_ids)]
+                dna_combined_notblank = dna_combined_notblank[~dna_combined_notblank["occurrenceID"].isin(all_ac_ids)]
+
+                # output
+
+                occurrence_blank_path, dna_blank_path, occurrence_path, dna_path = self.site_output_paths(site_name)
+
+                self.write_table(occurrence_combined_blank, occurrence_blank_path)
+                self.write_table(dna_combined_blank, dna_blank_path)
+
+                self.write_table(occurrence_combined_notblank, occurrence_path)
+                self.write_table(dna_combined_notblank, dna_path)
+
+                if self.archive is not None:
+                    self.submit(self.archive.add, [occurrence_blank_path, dna_blank_path, occurrence_path, dna_path])
+
+                # species lists
+
+                if self.list_generator is not None:
+                    self.list_generator.run(site_name, occurrence_combined_notblank, dna_combined_notblank, metadata_df_notblank)
+
+                # combined dataset
+
+                if self.combined_exporter is not None:
+                    self.combined_exporter.add_site(site_name, occurrence_combined_notblank, dna_combined_notblank)
+
+                # mark site as finished, queued after the site's pending writes
+
+                self.submit(self.checkpoints.save, site_name, "output", output_inputs[site_name])
+
+        finally:
+
+            # stop prefetching and flush pending writes, also when a site fails
+
+            sites.close()
+            self.close_writer()
+
+        # move the completed archives into place
+
+        if self.archive is not None:
+            self.archive.finish()
+        if self.list_generator is not None:
+            self.list_generator.finish_archive()
+
+        # index combined dataset
+
+        if self.combined_exporter is not None:
+            self.combined_exporter.close()
+
+        # report WoRMS usage
+
+        from ednaresults.aphia import worms_client
+        worms_client.report()
+
+    def read_site(self, site_name: str, datasets: list, markers: dict, dataset_files: dict) -> tuple:
+        """Read and combine the occurrence and DNA tables of all datasets for a site. Returns None if data is missing."""
+
+        logging.info(f"Reading {site_name} data")
+
+        occurrence_tables = []
+        dna_tables = []
+
+        for dataset in datasets:
+            marker = markers[dataset]
+            dataset_path = os.path.join(dataset, "05-dwca")
+
+            occurrence_path = os.path.join(dataset_path, self.occurrence_file)
+            dna_path = os.path.join(dataset_path, self.dna_file)
+
+            if self.occurrence_file not in dataset_files[dataset]:
+                logging.warn(f"Missing file {occurrence_path}")
+                continue
+            if self.dna_file not in dataset_files[dataset]:
+                logging.warn(f"Missing file {dna_path}")
+                continue
+
+            # read source files
+
+            occurrence = pd.read_csv(occurrence_path, sep="\t")
+            dna = pd.read_csv(dna_path, sep="\t")
+
+            # update occurrenceID
+
+            occurrence["occurrenceID"] = occurrence["occurrenceID"].astype(str) + f"_{marker}"
+            dna["occurrenceID"] = dna["occurrenceID"].astype(str) + f"_{marker}"
+
+            # add batch
+
+            if "batch1" in dataset:
+                occurrence["eventRemarks"] = "sequencing batch 1"
+            elif "batch2" in dataset:
+                occurrence["eventRemarks"] = "sequencing batch 2"
+
+            # append
+
+            occurrence_tables.append(occurrence)
+            dna_tables.append(dna)
+
+        # combine across samples and markers
+
+        if len(occurrence_tables) != len(dna_tables) or len(occurrence_tables) == 0:
+            return None
+
+        return pd.concat(occurrence_tables), pd.concat(dna_tables)
+
+    def close_writer(self) -> None:
+        writer = self.writer
+        self.writer = None
+        if self.list_generator is not None:
+            self.list_generator.writer = None
+        if writer is not None:
+            writer.close()
+
+    def submit(self, func, *args, **kwargs) -> None:
+        if self.writer is not None:
+            self.writer.submit(func, *args, **kwargs)
+        else:
+            func(*args, **kwargs)
+
+    def write_table(self, df: pd.DataFrame, path: str) -> None:
+        self.submit(df.to_csv, path, sep="\t", index=False, compression=self.compression)
+
+    def site_output_paths(self, site_name: str) -> list:
+        return [output_path(path, self.compression) for path in [
+            os.path.join(self.output_folder, "blank", f"{site_name}_Occurrence.tsv"),
+            os.path.join(self.output_folder, "blank", f"{site_name}_DNADerivedData.tsv"),
+            os.path.join(self.output_folder, f"{site_name}_Occurrence.tsv"),
+            os.path.join(self.output_folder, f"{site_name}_DNADerivedData.tsv")
+        ]]
+
+    def outputs_exist(self, site_name: str) -> bool:
+        paths = self.site_output_paths(site_name)
+        if self.list_generator is not None:
+            paths = paths + self.list_generator.site_output_paths(site_name)
+        return all(os.path.exists(path) for path in paths)
+
+    def list_inputs(self) -> dict:
+        if self.list_generator is None:
+            return None
+        return {"compression": self.list_generator.compression}
+
+    def annotation_inputs(self, site_name: str) -> list:
+        return [
+            file_fingerprint(f"annotations/{site_name}.json"),
+            file_fingerprint("annotations/contaminants.json") if self.remove_contaminants else None
+        ]
+
+    def prepare_output_folder(self, clear=True):
+        if clear:
+            logging.warn(f"Clearing output directory {self.output_folder}")
+            shutil.rmtree(self.output_folder, ignore_errors=True)
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+        if not os.path.exists(os.path.join(self.output_folder, "blank")):
+            os.makedirs(os.path.join(self.output_folder, "blank"))
+        if self.archive is not None:
+            self.archive.reset()
+
+        if self.list_generator is not None:
+            self.list_generator.prepare_output_folder(clear)
+
+    def read_sample_id_mapping(self) -> dict:
+        if self.sample_id_mapping_file is None:
+            return {}
+        if not os.path.exists(self.sample_id_mapping_file):
+            raise Exception(f"Sample ID mapping file {self.sample_id_mapping_file} not found")
+        logging.info(f"Reading sample ID mapping from {self.sample_id_mapping_file}")
+        return read_sample_id_mapping(self.sample_id_mapping_file)
+
+    def download_results(self) -> None:
+        logging.warning(f"Syncing pipeline results to {self.pipeline_data_path}")
+        os.system(f"aws s3 sync {self.results_source} {self.pipeline_data_path}")
+
+    def fetch_metadata(self) -> dict:
+        metadata_url = "https://raw.githubusercontent.com/iobis/edna-tracker-data/data/generated.json"
+        logging.info(f"Downloading metadata from {metadata_url}")
+        with urllib.request.urlopen(metadata_url) as url:
+            data = json.load(url)
+            return data
+
+    def fetch_metadata_df(self):
+        logging.info("Fetching metadata from PlutoF")
+        metadata = self.fetch_metadata()
+
+        metadata_df = pd.DataFrame.from_dict([{
+            "materialSampleID": sample["name"],
+            "locality": sample["area_locality"],
+            "decimalLongitude": sample["area_longitude"],
+            "decimalLatitude": sample["area_latitude"],
+            "sampleSize": sample["size"],
+            "higherGeography": sample["parent_area_name"],
+            "blank": sample["blank"],
+            "locationID": sample["station"],
+            "eventDate": sample["event_begin"],
+        } for sample in metadata["samples"]])
+
+        return metadata_df
+
+    def list_datasets(self) -> list:
+        if self.inventory.datasets is None:
+            self.inventory.load(self.rescan)
+        return self.inventory.list_datasets()
+
+    def validate_datasets(self) -> list:
+        report = self.resolver.classify(self.list_datasets())
+
+        for folder in report["ambiguous"]:
+            logging.warning(f"Ambiguous site or marker for {folder}")
+        for folder in report["unrecognized"]:
+            logging.error(f"Site or marker not recognized for {folder}")
+
+        if len(report["unrecognized"]) > 0:
+            raise Exception(f"{len(report['unrecognized'])} dataset folders not recognized")
+
+        logging.info(f"Resolved {len(report['datasets'])} datasets ({len(report['ambiguous'])} ambiguous)")
+        return report["datasets"]
+
+    def filter_datasets(self, datasets: list) -> list:
+        """Select the datasets of the requested sites and markers, fail on sites or markers without datasets."""
+
+        if self.sites is not None:
+            unknown = sorted(set(self.sites) - {dataset["site"] for dataset in datasets})
+            if len(unknown) > 0:
+                raise Exception(f"No datasets found for sites {', '.join(unknown)}")
+            datasets = [dataset for dataset in datasets if dataset["site"] in self.sites]
+        if self.markers is not None:
+            unknown = sorted(set(self.markers) - {dataset["marker"] for dataset in datasets})
+            if len(unknown) > 0:
+                raise Exception(f"No datasets found for markers {', '.join(unknown)}")
+            datasets = [dataset for dataset in datasets if dataset["marker"] in self.markers]
+        return datasets
+
+    def plan(self) -> dict:
+        """Return the dataset folders which would be processed by build, by site."""
+        self.inventory.load(self.rescan)
+        return self.get_folders_by_site(self.filter_datasets(self.validate_datasets()))
+
+    def generate_lists(self) -> None:
+        """Generate species lists from the occurrence and DNA tables of a previous build."""
+
+        metadata_df = self.fetch_metadata_df()
+        metadata_df_notblank = metadata_df[metadata_df["blank"] == False]
+
+        self.list_generator.prepare_output_folder(clear=not self.partial)
+
+        for site_name in self.plan():
+            _, _, occurrence_path, dna_path = self.site_output_paths(site_name)
+            if not os.path.exists(occurrence_path) or not os.path.exists(dna_path):
+                logging.warning(f"Skipping {site_name}, no output found")
+                continue
+            occurrence = pd.read_csv(occurrence_path, sep="\t")
+            dna = pd.read_csv(dna_path, sep="\t")
+            self.list_generator.run(site_name, occurrence, dna, metadata_df_notblank)
+
+        self.list_generator.finish_archive()
+
+    def get_folders_by_site(self, datasets=None):
+        if datasets is None:
+            datasets = self.filter_datasets(self.validate_datasets())
+
+        folders_by_site = {}
+
+        for dataset in datasets:
+            if dataset["site"] not in folders_by_site:
+                folders_by_site[dataset["site"]] = []
+            folders_by_site[dataset["site"]].append(dataset["folder"])
+
+        return folders_by_site
+
+    def replace_taxonomy(self, df: pd.DataFrame) -> pd.DataFrame:
+
+        from ednaresults.aphia import add_aphiaid, add_accepted_aphiaid, add_taxonomy
+
+        df = add_aphiaid(df)
+        df = add_accepted_aphiaid(df)
+        df["verbatimIdentification"] = df["scientificName"]
+        df = add_taxonomy(df)
+        return df
+
+    def apply_annotations(self, df_occurrence: pd.DataFrame, site_name: str) -> pd.DataFrame:
+
+        from ednaresults.aphia import worms_client
+
+        names_before = df_occurrence["scientificName"].nunique()
+
+        with open(f"annotations/{site_name}.json") as f:
+            annotations = json.load(f)
+            logging.info(f"Applying {len(annotations)} annotations for {site_name} ({names_before} names before)")
+            for annotation in annotations:
+
+                # get affected occurrenceIDs based on name
+
+                if "species" in annotation:
+                    field = "scientificName"
+                    name = annotation["species"].strip()
+                elif "genus" in annotation:
+                    field = "genus"
+                    name = annotation["genus"].strip()
+                elif "family" in annotation:
+                    field = "family"
+                    name = annotation["family"].strip()
+                elif "order" in annotation:
+                    field = "order"
+                    name = annotation["order"].strip()
+                elif "class" in annotation:
+                    field = "class"
+                    name = annotation["class"].strip()
+                elif "phylum" in annotation:
+                    field = "phylum"
+                    name = annotation["phylum"].strip()
+
+                occurrence_ids = list(df_occurrence.loc[df_occurrence[field] == name]["occurrenceID"])
+
+                # get affected occurrenceIDs based on AphiaID
+
+                if "AphiaID" in annotation:
+                    affected_taxon = worms_client.record_by_aphiaid(str(annotation["AphiaID"]).strip())
+                    affected_id = affected_taxon["valid_AphiaID"] if affected_taxon["valid_AphiaID"] is not None else affected_taxon["AphiaID"]
+                    occurrence_ids_aphiaid = list(df_occurrence.loc[df_occurrence["valid_AphiaID"].astype(int) == int(affected_id)]["occurrenceID"])
+                    occurrence_ids = list(set(occurrence_ids + occurrence_ids_aphiaid))
+
+                # apply
+
+                if "remove" in annotation and (annotation["remove"] == True or annotation["remove"] == "true"):
+
+                    logging.debug(f"Removing {field} {name} from {site_name}")
+                    # TODO: use higher taxon (phylum?) for scientificName and scientificNameID
+                    if len(occurrence_ids) > 0:
+                        affected = df_occurrence["occurrenceID"].isin(occurrence_ids)
+                        assign_values(df_occurrence, affected, {
+                            "class": None,
+                            "order": None,
+                            "family": None,
+                            "genus": None,
+                            "taxonRank": None,
+                            "scientificName": "incertae sedis",
+                            "scientificNameID": "urn:lsid:marinespecies.org:taxname:12"
+                        })
+                        df_occurrence.loc[affected, ["identificationRemarks"]] = "scientificName changed due to a manual annotation; " + df_occurrence.loc[affected, ["identificationRemarks"]]
+
+                if "remove" in annotation and (annotation["remove"] == False or annotation["remove"] == "false") and "new_AphiaID" in annotation:
+
+                    logging.debug(f"Updating {field} {name} for {site_name}")
+                    if len(occurrence_ids) > 0:
+                        new_taxon = worms_client.record_by_aphiaid(str(annotation["new_AphiaID"]).strip())
+                        affected = df_occurrence["occurrenceID"].isin(occurrence_ids)
+                        assign_values(df_occurrence, affected, {
+                            "kingdom": new_taxon["kingdom"],
+                            "phylum": new_taxon["phylum"],
+                            "class": new_taxon["class"],
+                            "order": new_taxon["order"],
+                            "family": new_taxon["family"],
+                            "genus": new_taxon["genus"],
+                            "scientificName": new_taxon["scientificname"],
+                            "scientificNameID": new_taxon["lsid"],
+                            "taxonRank": new_taxon["rank"].lower()
+                        })
+                        df_occurrence.loc[affected, ["identificationRemarks"]] = "scientificName changed due to a manual annotation; " + df_occurrence.loc[affected, ["identificationRemarks"]]
+
+            names_after = df_occurrence["scientificName"].nunique()
+            logging.info(f"{names_after} names after")
+
+        if self.remove_contaminants:
+
+            with open(f"annotations/contaminants.json") as f:
+                annotations = json.load(f)
+                logging.info(f"Removing {len(annotations)} contamintants for {site_name}")
+
+                for annotation in annotations:
+                    for rank, name in annotation.items():
+                        logging.debug(f"Removing {rank} {name} from {site_name}")
+                        occurrence_ids = list(df_occurrence.loc[df_occurrence[rank.strip()] == name.strip()]["occurrenceID"])
+                        df_occurrence = df_occurrence[~df_occurrence["occurrenceID"].isin(occurrence_ids)]
+
+                names_after = df_occurrence["scientificName"].nunique()
+                logging.info(f"{names_after} names after")
+
+        return df_occurrence
@@ -0,0 +1,69 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import pandas as pd
+
+
+def fingerprint(*parts) -> str:
+    """Hash the inputs of a stage, parts need to be JSON serializable."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_fingerprint(path: str) -> dict:
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class Checkpoints:
+    """Per site and per stage checkpoints in a state folder. Each checkpoint stores the fingerprint of its inputs, optionally
+    together with a pickled object, a checkpoint is only used if the fingerprint still matches. Clearing the state folder only
+    removes the site folders, other state such as the inventory is kept."""
+
+    def __init__(self, state_folder: str):
+        self.state_folder = state_folder
+
+    def prepare(self, resume: bool) -> None:
+        if not resume:
+            logging.warning(f"Clearing checkpoints in {self.state_folder}")
+            if os.path.exists(self.state_folder):
+                with os.scandir(self.state_folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(self.state_folder, exist_ok=True)
+
+    def paths(self, site_name: str, stage: str) -> tuple:
+        site_folder = os.path.join(self.state_folder, site_name)
+        return os.path.join(site_folder, f"{stage}.pkl"), os.path.join(site_folder, f"{stage}.json")
+
+    def exists(self, site_name: str, stage: str, inputs: str) -> bool:
+        data_path, meta_path = self.paths(site_name, stage)
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["fingerprint"] != inputs:
+            return False
+        return not meta.get("data", True) or os.path.exists(data_path)
+
+    def load(self, site_name: str, stage: str, inputs: str):
+        data_path, meta_path = self.paths(site_name, stage)
+        if not self.exists(site_name, stage, inputs) or not os.path.exists(data_path):
+            return None
+        logging.info(f"Resuming {site_name} from checkpoint {stage}")
+        return pd.read_pickle(data_path)
+
+    def save(self, site_name: str, stage: str, inputs: str, data=None) -> None:
+        data_path, meta_path = self.paths(site_name, stage)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        if data is not None:
+            pd.to_pickle(data, f"{data_path}.tmp")
+            os.replace(f"{data_path}.tmp", data_path)
+        elif os.path.exists(data_path):
+            os.remove(data_path)
+        with open(meta_path, "w") as f:
+            json.dump({"fingerprint": inputs, "data": data is not None}, f)
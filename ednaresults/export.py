@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import logging
+import pandas as pd
+
+
+INDEXES = {
+    "occurrence": ["valid_AphiaID", "scientificName", "materialSampleID", "site", "target_gene"],
+    "dna": ["occurrenceID", "site", "target_gene"]
+}
+
+
+class CombinedExporter:
+    """Writes the occurrence and DNA tables of all sites to a single SQLite database. The target_gene is added to the occurrence
+    table so occurrences can be queried by marker, indexes are created once all sites have been added."""
+
+    def __init__(self, database_path: str):
+        self.database_path = database_path
+        self.temp_path = f"{database_path}.tmp"
+        self.connection = None
+
+    def open(self) -> None:
+        logging.info(f"Creating combined database {self.database_path}")
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.connection = sqlite3.connect(self.temp_path)
+        self.connection.execute("pragma journal_mode = off")
+        self.connection.execute("pragma synchronous = off")
+
+    def add_site(self, site_name: str, occurrence: pd.DataFrame, dna: pd.DataFrame) -> None:
+        logging.info(f"Adding {site_name} to combined database")
+
+        occurrence = pd.merge(occurrence, dna[["occurrenceID", "target_gene"]].drop_duplicates("occurrenceID"), on="occurrenceID", how="left")
+        occurrence.insert(0, "site", site_name)
+        dna = dna.copy()
+        dna.insert(0, "site", site_name)
+
+        self.append("occurrence", occurrence)
+        self.append("dna", dna)
+
+    def append(self, table: str, df: pd.DataFrame) -> None:
+        """Append to a table, adding columns which are not in the table yet."""
+
+        columns = [row[1] for row in self.connection.execute(f"pragma table_info({table})")]
+        for column in df.columns:
+            if len(columns) > 0 and column not in columns:
+                self.connection.execute(f"alter table {table} add column \"{column}\"")
+
+        df.to_sql(table, self.connection, if_exists="append", index=False, chunksize=10000)
+
+    def close(self) -> None:
+        for table, columns in INDEXES.items():
+            existing = [row[1] for row in self.connection.execute(f"pragma table_info({table})")]
+            for column in columns:
+                if column in existing:
+                    logging.info(f"Creating index on {table}.{column}")
+                    self.connection.execute(f"create index \"{table}_{column}\" on {table} (\"{column}\")")
+
+        self.connection.commit()
+        self.connection.close()
+        self.connection = None
+        os.replace(self.temp_path, self.database_path)
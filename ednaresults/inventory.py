@@ -0,0 +1,128 @@
+import os
+import json
+import logging
+
+
+class Inventory:
+    """Inventory of the pipeline_data tree: the dataset folders of each project and size and mtime of their 05-dwca tables.
+    The tree is walked once with os.scandir and the result is persisted, a persisted inventory is reused as long as the
+    runs and 05-dwca folders have not been modified since. Tables which are rewritten in place do not change the folder
+    mtimes, these are only picked up by a rescan or by refreshing the tables of selected datasets."""
+
+    def __init__(self, pipeline_data_path: str, project_names: list, files: list, inventory_file: str):
+        self.pipeline_data_path = pipeline_data_path
+        self.project_names = project_names
+        self.files = files
+        self.inventory_file = inventory_file
+        self.datasets = None
+        self.folder_mtimes = None
+
+    def load(self, rescan: bool = False) -> "Inventory":
+        """Load the persisted inventory if it is still current, otherwise scan the tree and persist the result."""
+
+        if not rescan and self.read() and self.is_current():
+            logging.info(f"Using inventory {self.inventory_file} ({len(self.datasets)} datasets)")
+            return self
+
+        self.scan()
+        self.write()
+        return self
+
+    def scan(self) -> None:
+        logging.info(f"Scanning {self.pipeline_data_path}")
+        self.datasets = []
+        self.folder_mtimes = {}
+
+        for project_name in self.project_names:
+            root_folder = os.path.join(self.pipeline_data_path, project_name, "runs")
+            self.folder_mtimes[root_folder] = os.stat(root_folder).st_mtime
+
+            with os.scandir(root_folder) as entries:
+                dataset_entries = sorted([entry for entry in entries if entry.is_dir()], key=lambda entry: entry.name)
+
+            for dataset_entry in dataset_entries:
+                dataset_path = os.path.join(root_folder, dataset_entry.name, "05-dwca")
+                files = {}
+                try:
+                    self.folder_mtimes[dataset_path] = os.stat(dataset_path).st_mtime
+                    with os.scandir(dataset_path) as entries:
+                        for entry in entries:
+                            if entry.name in self.files and entry.is_file():
+                                stat = entry.stat()
+                                files[entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+                except FileNotFoundError:
+                    self.folder_mtimes[dataset_path] = None
+
+                self.datasets.append({
+                    "folder": os.path.join(root_folder, dataset_entry.name),
+                    "files": files
+                })
+
+        logging.info(f"Found {len(self.datasets)} datasets")
+
+    def is_current(self) -> bool:
+        """Check if the runs and 05-dwca folders are unchanged since the inventory was created."""
+
+        for path, mtime in self.folder_mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+            except FileNotFoundError:
+                if mtime is not None:
+                    return False
+        return True
+
+    def refresh(self, folders: list) -> None:
+        """Stat the tables of selected dataset folders again and persist the inventory if any of them changed."""
+
+        changed = 0
+        for dataset in self.datasets:
+            if dataset["folder"] not in folders:
+                continue
+            files = {}
+            for name in self.files:
+                try:
+                    stat = os.stat(os.path.join(dataset["folder"], "05-dwca", name))
+                except FileNotFoundError:
+                    continue
+                files[name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+            if files != dataset["files"]:
+                dataset["files"] = files
+                changed += 1
+
+        if changed > 0:
+            logging.info(f"Tables changed for {changed} datasets")
+            self.write()
+
+    def read(self) -> bool:
+        if not os.path.exists(self.inventory_file):
+            return False
+        with open(self.inventory_file) as f:
+            inventory = json.load(f)
+        if inventory.get("pipeline_data_path") != self.pipeline_data_path or inventory.get("project_names") != self.project_names or inventory.get("files") != self.files:
+            return False
+        self.datasets = inventory["datasets"]
+        self.folder_mtimes = inventory["folder_mtimes"]
+        return True
+
+    def write(self) -> None:
+        logging.info(f"Writing inventory {self.inventory_file}")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.inventory_file)), exist_ok=True)
+            with open(self.inventory_file, "w") as f:
+                json.dump({
+                    "pipeline_data_path": self.pipeline_data_path,
+                    "project_names": self.project_names,
+                    "files": self.files,
+                    "folder_mtimes": self.folder_mtimes,
+                    "datasets": self.datasets
+                }, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Could not write inventory {self.inventory_file} ({e}), pipeline_data will be scanned again next run")
+
+    def list_datasets(self) -> list:
+        return [dataset["folder"] for dataset in self.datasets]
+
+    def dataset_files(self) -> dict:
+        """Return the 05-dwca files found for each dataset folder, with their size and mtime."""
+        return {dataset["folder"]: dataset["files"] for dataset in self.datasets}
@@ -7,19 +7,23 @@ import logging
 import csv
 from pandas.api.types import is_numeric_dtype
 import shutil
+from ednaresults.output import Archive, check_compression, open_output, output_path
 
 
 class ListGenerator:
 
-    def __init__(self):
-        self.output_folder = "output_lists"
-
-        self.database_species = self.fetch_database_species()
-        self.database_species = add_accepted_aphiaid(self.database_species)
-
-    def prepare_output_folder(self):
-        logging.warn(f"Clearing output directory {self.output_folder}")
-        shutil.rmtree(self.output_folder, ignore_errors=True)
+    def __init__(self, output_folder="output_lists", compression=None, archive=True):
+        self.output_folder = output_folder
+        self.writer = None
+        check_compression(compression)
+        self.compression = compression
+        self.archive = Archive(self.output_folder, compressed=compression is not None) if archive else None
+        self.database_species = None
+
+    def prepare_output_folder(self, clear=True):
+        if clear:
+            logging.warn(f"Clearing output directory {self.output_folder}")
+            shutil.rmtree(self.output_folder, ignore_errors=True)
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
 
@@ -31,7 +35,14 @@ class ListGenerator:
         ]
 
         for subfolder in subfolders:
-            os.makedirs(subfolder)
+            os.makedirs(subfolder, exist_ok=True)
+
+        if self.archive is not None:
+            self.archive.reset()
+
+    def load_database_species(self):
+        self.database_species = self.fetch_database_species()
+        self.database_species = add_accepted_aphiaid(self.database_species)
 
     def fetch_database_species(self):
         logging.info("Fetching database species list from AWS")
@@ -43,18 +54,47 @@ class ListGenerator:
         species["records"] = species["records"].astype("Int64")
         return species
 
+    def write(self, func, *args, **kwargs):
+        if self.writer is not None:
+            self.writer.submit(func, *args, **kwargs)
+        else:
+            func(*args, **kwargs)
+
+    def write_json(self, path, data):
+        with open_output(path, self.compression) as file:
+            file.write(json.dumps(data, indent=2, ignore_nan=True))
+
+    def site_output_paths(self, site_name):
+        return [output_path(path, self.compression) for path in [
+            os.path.join(self.output_folder, "lists_full", "csv", f"{site_name}.csv"),
+            os.path.join(self.output_folder, "lists", "csv", f"{site_name}.csv"),
+            os.path.join(self.output_folder, "lists_full", "json", f"{site_name}.json"),
+            os.path.join(self.output_folder, "lists", "json", f"{site_name}.json")
+        ]]
+
+    def add_to_archive(self, site_name):
+        if self.archive is not None:
+            self.write(self.archive.add, self.site_output_paths(site_name))
+
+    def finish_archive(self):
+        if self.archive is not None:
+            self.archive.finish()
+
     def clean_json_records(self, records):
         return [{k: record[k] for k in record if not pd.isna(record[k])} for record in records]
 
     def run(self, site_name, occurrence, dna, metadata):
 
+        if self.database_species is None:
+            self.load_database_species()
+
         # get dna species (non blank)
 
         occurrence_species = occurrence[(occurrence["taxonRank"].str.lower() == "species") & (occurrence["blank"].notna())][["materialSampleID", "occurrenceID", "scientificName", "scientificNameID", "organismQuantity"]]
         dna = dna[["occurrenceID", "target_gene"]]
         df = pd.merge(occurrence_species, dna, on="occurrenceID", how="inner")
         df["AphiaID"] = df.scientificNameID.str.extract("(\d+)")
-        edna_species = df.groupby(["scientificName", "AphiaID"]) \
+        edna_species = df.groupby(["scientificName", "AphiaID"], observed=True) \
             .agg(
                 reads=("organismQuantity", "sum"),
                 target_gene=("target_gene", lambda x: ",".join(set(x))),
@@ -184,16 +224,13 @@ class ListGenerator:
 
         # output
 
-        csv_full_path = os.path.join(self.output_folder, "lists_full", "csv", f"{site_name}.csv")
-        csv_dna_path = os.path.join(self.output_folder, "lists", "csv", f"{site_name}.csv")
-        json_full_path = os.path.join(self.output_folder, "lists_full", "json", f"{site_name}.json")
-        json_dna_path = os.path.join(self.output_folder, "lists", "json", f"{site_name}.json")
+        csv_full_path, csv_dna_path, json_full_path, json_dna_path = self.site_output_paths(site_name)
 
         logging.info(f"Writing {csv_full_path}")
-        aggregated.to_csv(csv_full_path, index=False, quoting=csv.QUOTE_NONNUMERIC)
+        self.write(aggregated.to_csv, csv_full_path, index=False, quoting=csv.QUOTE_NONNUMERIC, compression=self.compression)
 
         logging.info(f"Writing {csv_dna_path}")
-        aggregated[aggregated["source_dna"]].to_csv(csv_dna_path, index=False, quoting=csv.QUOTE_NONNUMERIC)
+        self.write(aggregated[aggregated["source_dna"]].to_csv, csv_dna_path, index=False, quoting=csv.QUOTE_NONNUMERIC, compression=self.compression)
 
         timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         json_full = {
@@ -217,8 +254,8 @@ class ListGenerator:
             }
         }
         logging.info(f"Writing {json_full_path}")
-        with open(json_full_path, "w") as file:
-            file.write(json.dumps(json_full, indent=2, ignore_nan=True))
+        self.write(self.write_json, json_full_path, json_full)
         logging.info(f"Writing {json_dna_path}")
-        with open(json_dna_path, "w") as file:
-            file.write(json.dumps(json_dna, indent=2, ignore_nan=True))
+        self.write(self.write_json, json_dna_path, json_dna)
+
+        self.add_to_archive(site_name)
@@ -0,0 +1,85 @@
+import os
+import gzip
+import logging
+import zipfile
+
+
+COMPRESSION_EXTENSIONS = {
+    None: "",
+    "gzip": ".gz",
+    "zstd": ".zst"
+}
+
+
+def check_compression(compression: str = None) -> None:
+    """Fail before any work is done if a compression method is not supported or its module is not installed."""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Compression {compression} not supported")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package")
+
+
+def output_path(path: str, compression: str = None) -> str:
+    """Add the extension for a compression method to an output path."""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Compression {compression} not supported")
+    return path + COMPRESSION_EXTENSIONS[compression]
+
+
+def open_output(path: str, compression: str = None):
+    """Open a text file for writing, compressed if a compression method is given."""
+    if compression == "gzip":
+        return gzip.open(path, "wt")
+    elif compression == "zstd":
+        import zstandard
+        return zstandard.open(path, "wt")
+    return open(path, "w")
+
+
+class Archive:
+    """Zip archive of an output folder which is assembled incrementally, files are added as soon as they have been written.
+    Files which are already compressed are stored as is. The archive is assembled in a temporary file which only replaces
+    the archive when finished, so a failed build never leaves a partial archive in place."""
+
+    def __init__(self, folder: str, compressed: bool = False):
+        self.folder = folder
+        self.path = f"{folder.rstrip('/')}.zip"
+        self.temp_path = f"{self.path}.tmp"
+        self.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+
+    def reset(self) -> None:
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def add(self, paths: list) -> None:
+        root = os.path.dirname(os.path.abspath(self.folder))
+        with zipfile.ZipFile(self.temp_path, "a", compression=self.compress_type) as archive:
+            for path in paths:
+                if not os.path.exists(path):
+                    logging.warning(f"Missing file {path}, not added to {self.path}")
+                    continue
+                logging.debug(f"Adding {path} to {self.path}")
+                archive.write(path, os.path.relpath(os.path.abspath(path), root))
+
+    def finish(self) -> None:
+        if not os.path.exists(self.temp_path):
+            logging.warning(f"No files added to {self.path}")
+            return
+        logging.info(f"Writing archive {self.path}")
+        os.replace(self.temp_path, self.path)
+
+
+def archive_is_current(folder: str, path: str) -> bool:
+    """Check if an archive exists and is newer than all files in a folder."""
+
+    if not os.path.exists(path):
+        return False
+    archive_mtime = os.stat(path).st_mtime
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            if os.stat(os.path.join(root, filename)).st_mtime > archive_mtime:
+                return False
+    return True
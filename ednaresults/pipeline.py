@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+
+
+class Prefetcher:
+    """Iterates over (item, func(item)) pairs, evaluating func for the next items in a background thread. At most max_pending
+    results, queued or being evaluated, are held in memory ahead of the item the consumer is working on."""
+
+    done = object()
+
+    def __init__(self, items, func, max_pending: int = 1):
+        self.items = list(items)
+        self.func = func
+        self.queue = queue.Queue()
+        self.slots = threading.Semaphore(max_pending)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+
+    def work(self) -> None:
+        for item in self.items:
+            self.slots.acquire()
+            if self.stopped.is_set():
+                return
+            try:
+                result = (item, self.func(item), None)
+            except Exception as e:
+                result = (item, None, e)
+            self.queue.put(result)
+            if result[2] is not None:
+                return
+        self.queue.put(self.done)
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                result = self.queue.get()
+                if result is self.done:
+                    return
+                self.slots.release()
+                item, value, error = result
+                if error is not None:
+                    raise error
+                yield item, value
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.slots.release()
+        self.thread.join()
+
+
+class BackgroundWriter:
+    """Runs write functions in a background thread. submit blocks when max_pending writes are queued, errors are raised
+    from the next submit or from close."""
+
+    def __init__(self, max_pending: int = 4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            func, args, kwargs = task
+            if self.error is not None:
+                continue
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Background write failed: {e}")
+                self.error = e
+
+    def submit(self, func, *args, **kwargs) -> None:
+        self.raise_error()
+        self.queue.put((func, args, kwargs))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
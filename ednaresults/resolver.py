@@ -0,0 +1,141 @@
+import json
+import logging
+import re
+
+
+SITE_PREFIXES = {
+    "cocos": "cocos_island_national_park",
+    "galapagos": "galapagos_islands",
+    "coiba": "coiba_national_park_and_its_special_zone_of_marine_protection",
+    "banc": "banc_d_arguin_national_park",
+    "tubbataha": "tubbataha_reefs_natural_park",
+    "wadden": "wadden_sea",
+    "sundarbans": "the_sundarbans",
+    "revillagigedo": "archipielago_de_revillagigedo",
+    "everglades": "everglades_national_park",
+    "aldabra": "aldabra_atoll",
+    "lord": "lord_howe_island_group",
+    "french": "french_austral_lands_and_seas",
+    "shark": "shark_bay_western_australia",
+    "isimangaliso": "isimangaliso_wetland_park",
+    "porto": "gulf_of_porto_calanche_of_piana_gulf_of_girolata_scandola_reserve",
+    "belize": "belize_barrier_reef_reserve_system",
+    "lagoons": "lagoons_of_new_caledonia_reef_diversity_and_associated_ecosystems",
+    "brazilian": "brazilian_atlantic_islands_fernando_de_noronha_and_atol_das_rocas_reserves",
+    "ningaloo": "ningaloo_coast",
+    "sanganeb": "sanganeb_marine_national_park_and_dungonab_bay_mukkawar_island_marine_national_park",
+    "scandola": "gulf_of_porto_calanche_of_piana_gulf_of_girolata_scandola_reserve",
+    "brazil": "brazilian_atlantic_islands_fernando_de_noronha_and_atol_das_rocas_reserves",
+    "mauritania": "banc_d_arguin_national_park",
+    "southernocean": "french_austral_lands_and_seas",
+    "newcaledonia": "lagoons_of_new_caledonia_reef_diversity_and_associated_ecosystems",
+    "philippines": "tubbataha_reefs_natural_park",
+    "bangladesh": "the_sundarbans",
+    "southafrica": "isimangaliso_wetland_park",
+    "seychel": "aldabra_atoll",
+    "mexico": "archipielago_de_revillagigedo",
+    "yemen": "socotra_archipelago",
+    "argentina": "peninsula_valdes"
+}
+
+MARKER_KEYS = {
+    "mimammal": "12s_mimammal",
+    "mifish": "12s_mifish",
+    "teleo": "12s_teleo",
+    "coi": "coi",
+    "co1": "coi",
+    "16s": "16s",
+}
+
+
+def compile_keys(keys: list) -> re.Pattern:
+    """Compile keys into a single alternation, longest keys first so the most specific key wins."""
+    return re.compile("|".join(re.escape(key) for key in sorted(keys, key=len, reverse=True)))
+
+
+class DatasetResolver:
+    """Resolves site and marker names from dataset folder names. Keys are matched in mapping order, site keys as prefixes of the
+    folder name and marker keys as substrings of the second underscore separated part of the folder name. A JSON mapping file with
+    "sites" and/or "markers" objects can be used to replace the default mappings."""
+
+    def __init__(self, mapping_file: str = None):
+        self.site_map = SITE_PREFIXES
+        self.marker_map = MARKER_KEYS
+
+        if mapping_file is not None:
+            logging.info(f"Reading dataset name mapping from {mapping_file}")
+            with open(mapping_file) as f:
+                mapping = json.load(f)
+                self.site_map = mapping.get("sites", self.site_map)
+                self.marker_map = mapping.get("markers", self.marker_map)
+
+        self.site_order = {key: i for i, key in enumerate(self.site_map)}
+        self.marker_order = {key: i for i, key in enumerate(self.marker_map)}
+        self.site_pattern = compile_keys(self.site_map)
+        self.marker_pattern = compile_keys(self.marker_map)
+
+        # for every site key, all keys that are a prefix of it, in mapping order
+
+        self.site_prefixes = {
+            key: sorted([other for other in self.site_map if key.startswith(other)], key=self.site_order.get)
+            for key in self.site_map
+        }
+
+    @staticmethod
+    def folder_name(folder: str) -> str:
+        return folder.rstrip("/").split("/")[-1].lower()
+
+    def match_site(self, folder: str) -> list:
+        """Return all site names matching a folder, first match has precedence."""
+        match = self.site_pattern.match(self.folder_name(folder))
+        if match is None:
+            return []
+        return list(dict.fromkeys(self.site_map[key] for key in self.site_prefixes[match.group()]))
+
+    def match_marker(self, folder: str) -> list:
+        """Return all marker names matching a folder, first match has precedence."""
+        parts = self.folder_name(folder).split("_")
+        if len(parts) < 2:
+            return []
+        keys = sorted(set(self.marker_pattern.findall(parts[1])), key=self.marker_order.get)
+        return list(dict.fromkeys(self.marker_map[key] for key in keys))
+
+    def resolve_site(self, folder: str) -> str:
+        sites = self.match_site(folder)
+        if len(sites) == 0:
+            raise Exception(f"Site {folder} not recognized")
+        return sites[0]
+
+    def resolve_marker(self, folder: str) -> str:
+        markers = self.match_marker(folder)
+        if len(markers) == 0:
+            raise Exception(f"Marker {folder} not recognized")
+        return markers[0]
+
+    def classify(self, folders: list) -> dict:
+        """Classify dataset folders in one pass. Returns the recognized datasets with their site and marker, as well as the
+        unrecognized and ambiguous folders."""
+
+        datasets = []
+        unrecognized = []
+        ambiguous = []
+
+        for folder in folders:
+            sites = self.match_site(folder)
+            markers = self.match_marker(folder)
+            if len(sites) == 0 or len(markers) == 0:
+                unrecognized.append(folder)
+                continue
+            if len(sites) > 1 or len(markers) > 1:
+                ambiguous.append(folder)
+            datasets.append({
+                "folder": folder,
+                "site": sites[0],
+                "marker": markers[0]
+            })
+
+        return {
+            "datasets": datasets,
+            "unrecognized": unrecognized,
+            "ambiguous": ambiguous
+        }
@@ -2,29 +2,30 @@ import os
 import boto3
 from botocore.exceptions import NoCredentialsError
 from dotenv import load_dotenv
+from ednaresults.output import archive_is_current
 
 
-load_dotenv()
-ACCESS_KEY = os.environ["AWS_ACCESS_KEY_ID"]
-SECRET_KEY = os.environ["AWS_SECRET_ACCESS_KEY"]
+def s3_client():
+    load_dotenv()
+    return boto3.client("s3", aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"], aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"])
 
 
-def upload_results():
+def upload_results(output_folder="output", bucket_name="obis-edna-results"):
 
-    OUPUT_FOLDER = "output"
-    BUCKET_NAME = "obis-edna-results"
+    # compress all files in output folder, unless an archive newer than all files has been assembled during the build
 
-    # compress all files in output folder
-
-    zip_file = f"{OUPUT_FOLDER}.zip"
-    os.system(f"zip -r {OUPUT_FOLDER}.zip {OUPUT_FOLDER}")
+    zip_file = f"{output_folder}.zip"
+    if not archive_is_current(output_folder, zip_file):
+        if os.path.exists(zip_file):
+            os.remove(zip_file)
+        os.system(f"zip -r {output_folder}.zip {output_folder}")
 
     # upload zip file to S3
 
-    s3 = boto3.client("s3", aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY)
+    s3 = s3_client()
 
     try:
-        s3.upload_file(zip_file, BUCKET_NAME, zip_file)
+        s3.upload_file(zip_file, bucket_name, os.path.basename(zip_file))
         print("Upload Successful")
     except FileNotFoundError:
         print("File not found")
@@ -32,22 +33,22 @@ def upload_results():
         print("Credentials not available")
 
 
-def upload_lists():
-
-    OUPUT_FOLDER = "output_lists"
-    BUCKET_NAME = "obis-edna-lists"
+def upload_lists(output_folder="output_lists", bucket_name="obis-edna-lists"):
 
-    # compress all files in output folder
+    # compress all files in output folder, unless an archive newer than all files has been assembled during the build
 
-    zip_file = f"{OUPUT_FOLDER}.zip"
-    os.system(f"zip -r {OUPUT_FOLDER}.zip {OUPUT_FOLDER}")
+    zip_file = f"{output_folder}.zip"
+    if not archive_is_current(output_folder, zip_file):
+        if os.path.exists(zip_file):
+            os.remove(zip_file)
+        os.system(f"zip -r {output_folder}.zip {output_folder}")
 
     # upload zip file to S3
 
-    s3 = boto3.client("s3", aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY)
+    s3 = s3_client()
 
     try:
-        s3.upload_file(zip_file, BUCKET_NAME, zip_file)
+        s3.upload_file(zip_file, bucket_name, os.path.basename(zip_file))
         print("Upload Successful")
     except FileNotFoundError:
         print("File not found")
@@ -56,15 +57,15 @@ def upload_lists():
 
     # upload files to S3
 
-    for root, dirs, files in os.walk(OUPUT_FOLDER):
+    for root, dirs, files in os.walk(output_folder):
 
         for filename in files:
-            if filename.endswith(".csv") or filename.endswith(".json"):
+            if filename.endswith((".csv", ".json", ".csv.gz", ".json.gz", ".csv.zst", ".json.zst")):
                 local_path = os.path.join(root, filename)
-                relative_path = os.path.relpath(local_path, OUPUT_FOLDER)
+                relative_path = os.path.relpath(local_path, output_folder)
                 print(f"Uploading {local_path} to {relative_path}")
                 try:
-                    s3.upload_file(local_path, BUCKET_NAME, relative_path)
+                    s3.upload_file(local_path, bucket_name, relative_path)
                     print("Upload Successful")
                 except FileNotFoundError:
                     print("File not found")
@@ -72,5 +73,6 @@ def upload_lists():
                     print("Credentials not available")
 
 
-upload_results()
-upload_lists()
+if __name__ == "__main__":
+    upload_results()
+    upload_lists()
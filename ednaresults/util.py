@@ -1,57 +1,67 @@
+import numpy as np
+import pandas as pd
+from ednaresults.resolver import DatasetResolver
+
+
+default_resolver = DatasetResolver()
+
+
 def derive_site_name(input: str) -> str:
-    site_dict = {
-        "cocos": "cocos_island_national_park",
-        "galapagos": "galapagos_islands",
-        "coiba": "coiba_national_park_and_its_special_zone_of_marine_protection",
-        "banc": "banc_d_arguin_national_park",
-        "tubbataha": "tubbataha_reefs_natural_park",
-        "wadden": "wadden_sea",
-        "sundarbans": "the_sundarbans",
-        "revillagigedo": "archipielago_de_revillagigedo",
-        "everglades": "everglades_national_park",
-        "aldabra": "aldabra_atoll",
-        "lord": "lord_howe_island_group",
-        "french": "french_austral_lands_and_seas",
-        "shark": "shark_bay_western_australia",
-        "isimangaliso": "isimangaliso_wetland_park",
-        "porto": "gulf_of_porto_calanche_of_piana_gulf_of_girolata_scandola_reserve",
-        "belize": "belize_barrier_reef_reserve_system",
-        "lagoons": "lagoons_of_new_caledonia_reef_diversity_and_associated_ecosystems",
-        "brazilian": "brazilian_atlantic_islands_fernando_de_noronha_and_atol_das_rocas_reserves",
-        "ningaloo": "ningaloo_coast",
-        "sanganeb": "sanganeb_marine_national_park_and_dungonab_bay_mukkawar_island_marine_national_park",
-        "scandola": "gulf_of_porto_calanche_of_piana_gulf_of_girolata_scandola_reserve",
-        "brazil": "brazilian_atlantic_islands_fernando_de_noronha_and_atol_das_rocas_reserves",
-        "mauritania": "banc_d_arguin_national_park",
-        "southernocean": "french_austral_lands_and_seas",
-        "newcaledonia": "lagoons_of_new_caledonia_reef_diversity_and_associated_ecosystems",
-        "philippines": "tubbataha_reefs_natural_park",
-        "bangladesh": "the_sundarbans",
-        "southafrica": "isimangaliso_wetland_park",
-        "seychel": "aldabra_atoll",
-        "mexico": "archipielago_de_revillagigedo",
-        "yemen": "socotra_archipelago",
-        "argentina": "peninsula_valdes"
-    }
-    input_lower = input.split("/")[-1].lower()
-    for key in site_dict:
-        if input_lower.startswith(key):
-            return site_dict[key]
-    raise Exception(f"Site {input} not recognized")
+    return default_resolver.resolve_site(input)
 
 
 def derive_marker_name(input: str) -> str:
-    marker_dict = {
-        "mimammal": "12s_mimammal",
-        "mifish": "12s_mifish",
-        "teleo": "12s_teleo",
-        "coi": "coi",
-        "co1": "coi",
-        "16s": "16s",
-    }
-    input_marker = input.split("/")[-1].split("_")[1]
-    input_lower = input_marker.lower()
-    for key in marker_dict:
-        if key in input_lower:
-            return marker_dict[key]
-    raise Exception(f"Marker {input} not recognized")
+    return default_resolver.resolve_marker(input)
+
+
+def read_sample_id_mapping(path: str) -> dict:
+    """Read a sample ID remapping table with source and target columns."""
+    mapping = pd.read_csv(path, dtype=str)
+    return dict(zip(mapping["source"].str.strip(), mapping["target"].str.strip()))
+
+
+def remap_sample_ids(series: pd.Series, mapping: dict) -> pd.Series:
+    """Replace sample IDs in a low cardinality string column. Replacements are only applied to the distinct values."""
+
+    categorical = series.astype("category")
+    categories = categorical.cat.categories
+    for source, target in mapping.items():
+        categories = categories.str.replace(source, target, regex=False)
+
+    codes = categorical.cat.codes.to_numpy()
+    values = categories.to_numpy(dtype=object)[codes]
+    values[codes == -1] = None
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def remap_to_shared_categorical(mapping: dict, *series: pd.Series) -> list[pd.Series]:
+    """Replace sample IDs in string columns and convert them to categoricals sharing the same categories, so joins and isin
+    checks work on codes. The columns are factorized together once, replacements are applied to the distinct values."""
+
+    codes, uniques = pd.factorize(pd.concat(series, ignore_index=True), sort=False)
+    categories = pd.Index(uniques)
+    for source, target in mapping.items():
+        categories = categories.str.replace(source, target, regex=False)
+
+    # replacements can map distinct values onto the same value
+
+    if len(mapping) > 0 and not categories.is_unique:
+        category_codes, categories = pd.factorize(categories, sort=False)
+        codes = np.where(codes == -1, -1, category_codes[codes])
+
+    dtype = pd.CategoricalDtype(categories)
+    result = []
+    start = 0
+    for s in series:
+        result.append(pd.Series(pd.Categorical.from_codes(codes[start:start + len(s)], dtype=dtype), index=s.index, name=s.name))
+        start += len(s)
+    return result
+
+
+def assign_values(df: pd.DataFrame, rows: pd.Series, values: dict) -> None:
+    """Assign values to a selection of rows, adding categories to categorical columns where needed."""
+
+    for column, value in values.items():
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and not pd.isna(value) and value not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([value])
+        df.loc[rows, column] = value
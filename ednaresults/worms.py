@@ -0,0 +1,142 @@
+import time
+import logging
+from urllib.parse import quote_plus
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, RequestException
+from urllib3 import Retry
+
+
+class WormsClient:
+    """Client for the WoRMS REST API. Requests share a pooled keep-alive session with gzip encoding. Batch requests are
+    filled up to the server's batch limit and a maximum URL length. When a batch fails its size becomes a ceiling and the
+    batch size is halved, after successful requests it grows back gradually but stays below the ceiling. Failed status codes
+    are only retried with backoff for single value requests, larger batches are split instead. Keeps track of the number of
+    requests, bytes and time spent."""
+
+    def __init__(self, base_url: str = "https://www.marinespecies.org/rest", max_batch_size: int = 50, max_url_length: int = 4000, pool_size: int = 4, timeout: int = 60):
+        self.base_url = base_url
+        self.max_batch_size = max_batch_size
+        self.max_url_length = max_url_length
+        self.batch_size = max_batch_size
+        self.ceiling = None
+        self.timeout = timeout
+
+        self.session = self.create_session(pool_size, Retry(total=5, backoff_factor=2, status_forcelist=(500, 502, 504)))
+        self.batch_session = self.create_session(pool_size, Retry(total=5, backoff_factor=2, status=0))
+
+        self.records = {}
+        self.requests = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.elapsed = 0.0
+
+    @staticmethod
+    def create_session(pool_size: int, retries: Retry) -> Session:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip"})
+        return session
+
+    def get(self, path: str, params: list = None, session: Session = None):
+        session = session if session is not None else self.session
+        start = time.perf_counter()
+        res = session.get(f"{self.base_url}/{path}", params=params, timeout=self.timeout)
+        self.elapsed += time.perf_counter() - start
+        self.requests += 1
+        self.bytes += len(res.content)
+        self.wire_bytes += int(res.headers.get("Content-Length", len(res.content)))
+        return res
+
+    def next_batch(self, path: str, params: list, param: str, values: list) -> list:
+        """Take as many values as fit in the current batch size and the maximum URL length, at least one."""
+
+        length = len(self.base_url) + len(path) + 2 + sum(len(quote_plus(key)) + len(quote_plus(str(value))) + 2 for key, value in params)
+        encoded_param = len(quote_plus(param))
+        batch = []
+        for value in values[:self.batch_size]:
+            length += encoded_param + len(quote_plus(str(value))) + 2
+            if length > self.max_url_length and len(batch) > 0:
+                break
+            batch.append(value)
+        return batch
+
+    def batched_get(self, path: str, param: str, values: list, params: list = None, positional: bool = False):
+        """Request values in batches, yielding each batch with its decoded response. A 204 response yields None. For
+        positional responses, values missing from the end of a short response are requested again."""
+
+        params = params if params is not None else []
+        pending = list(values)
+
+        while len(pending) > 0:
+            batch = self.next_batch(path, params, param, pending)
+
+            try:
+                res = self.get(path, params + [(param, value) for value in batch], self.session if len(batch) == 1 else self.batch_session)
+                res.raise_for_status()
+            except RequestException as e:
+                if len(batch) == 1:
+                    raise
+                self.ceiling = len(batch) if self.ceiling is None else min(self.ceiling, len(batch))
+                self.batch_size = max(1, len(batch) // 2)
+                status = e.response.status_code if isinstance(e, HTTPError) and e.response is not None else type(e).__name__
+                logging.warning(f"WoRMS request with {len(batch)} values failed ({status}), reducing batch size to {self.batch_size}")
+                continue
+
+            self.grow_batch_size()
+
+            if res.status_code == 204:
+                pending = pending[len(batch):]
+                yield batch, None
+                continue
+
+            data = res.json()
+            if positional and 0 < len(data) < len(batch):
+                logging.debug(f"Short WoRMS response ({len(data)} of {len(batch)}), requesting remaining values again")
+                batch = batch[:len(data)]
+            pending = pending[len(batch):]
+            yield batch, data
+
+    def grow_batch_size(self) -> None:
+        """Grow the batch size by a quarter, staying below the smallest batch size which failed."""
+
+        limit = self.max_batch_size if self.ceiling is None else min(self.max_batch_size, self.ceiling - 1)
+        self.batch_size = max(1, min(limit, self.batch_size + max(1, self.batch_size // 4)))
+
+    def match_names(self, names: list, marine_only: bool = False) -> dict:
+        """Match names, returns the list of matching records for each name."""
+
+        matches = {}
+        params = [("marine_only", str(marine_only).lower())]
+        for batch, data in self.batched_get("AphiaRecordsByMatchNames", "scientificnames[]", names, params, positional=True):
+            for i, name in enumerate(batch):
+                matches[name] = data[i] if data is not None and i < len(data) and data[i] is not None else []
+        return matches
+
+    def records_by_aphiaids(self, aphiaids: list) -> dict:
+        """Fetch records by AphiaID. AphiaIDs which are not found are missing from the result."""
+
+        records = {}
+        for batch, data in self.batched_get("AphiaRecordsByAphiaIDs", "aphiaids[]", aphiaids):
+            if data is None:
+                continue
+            for record in data:
+                if record is not None:
+                    records[record["AphiaID"]] = record
+        return records
+
+    def record_by_aphiaid(self, aphiaid: int) -> dict:
+        """Fetch a single record by AphiaID, records are cached."""
+
+        aphiaid = int(aphiaid)
+        if aphiaid not in self.records:
+            res = self.get(f"AphiaRecordByAphiaID/{aphiaid}")
+            res.raise_for_status()
+            self.records[aphiaid] = res.json() if res.status_code != 204 else None
+        return self.records[aphiaid]
+
+    def report(self) -> None:
+        rate = self.requests / self.elapsed if self.elapsed > 0 else 0
+        logging.info(f"WoRMS: {self.requests} requests in {self.elapsed:.1f}s ({rate:.1f} requests/s), {self.bytes} bytes ({self.wire_bytes} bytes transferred)")
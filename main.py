@@ -1,18 +1,131 @@
-from ednaresults import OccurrenceBuilder
-from ednaresults.lists import ListGenerator
 import logging
-from dotenv import load_dotenv
+import argparse
+from ednaresults import RESULTS_SOURCE
 
 
-load_dotenv()
 logger = logging.getLogger(__name__)
-logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=logging.INFO)
 
 
-list_generator = ListGenerator()
-occurrence_builder = OccurrenceBuilder(
-    pipeline_data_path="/Volumes/acasis/pipeline_data_20260107/",
-    list_generator=list_generator,
-    sync_results=False
-)
-occurrence_builder.build()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process eDNA Expeditions pipeline results into an integrated dataset")
+    parser.add_argument("--pipeline-data", default="./pipeline_data/", help="folder with pipeline results (default: %(default)s)")
+    parser.add_argument("--output", default="output", help="output folder for the dataset (default: %(default)s)")
+    parser.add_argument("--lists-output", default="output_lists", help="output folder for the species lists (default: %(default)s)")
+    parser.add_argument("--state", default="state", help="folder for build checkpoints (default: %(default)s)")
+    parser.add_argument("--log-level", default="INFO", help="logging level (default: %(default)s)")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="download pipeline results from S3")
+    sync_parser.add_argument("--source", default=RESULTS_SOURCE, help="S3 location of the pipeline results (default: %(default)s)")
+
+    for name, help in [("build", "build the dataset and species lists"), ("lists", "generate species lists from a previous build")]:
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument("--site", action="append", dest="sites", help="only process this site, can be repeated")
+        subparser.add_argument("--marker", action="append", dest="markers", help="only process this marker, can be repeated, requires separate output folders")
+        subparser.add_argument("--dry-run", action="store_true", help="list the datasets to process and exit")
+        subparser.add_argument("--compression", choices=["gzip", "zstd"], help="compress output files")
+        subparser.add_argument("--rescan", action="store_true", help="scan pipeline data instead of reusing the inventory")
+        subparser.add_argument("--dataset-names", help="JSON file with \"sites\" and/or \"markers\" mappings for dataset folder names")
+
+    build_parser = subparsers.choices["build"]
+    build_parser.add_argument("--sync", action="store_true", help="download pipeline results before building")
+    build_parser.add_argument("--source", default=RESULTS_SOURCE, help="S3 location of the pipeline results (default: %(default)s)")
+    build_parser.add_argument("--resume", action="store_true", help="resume from the checkpoints of a previous build")
+    build_parser.add_argument("--pipelined", action="store_true", help="read and write in background threads")
+    build_parser.add_argument("--combined-database", help="also write all sites to this SQLite database")
+    build_parser.add_argument("--no-lists", action="store_true", help="do not generate species lists")
+    build_parser.add_argument("--sample-id-mapping", default="supporting_data/sample_id_mapping.csv", help="CSV file with source and target sample IDs (default: %(default)s)")
+
+    upload_parser = subparsers.add_parser("upload", help="upload the dataset and species lists to S3")
+    upload_parser.add_argument("--no-lists", action="store_true", help="do not upload species lists")
+
+    args = parser.parse_args(argv)
+
+    # a marker subset is written per site, so it would replace the full outputs of the selected sites
+
+    if getattr(args, "markers", None) is not None and not args.dry_run:
+        if args.output == parser.get_default("output"):
+            parser.error("--marker only builds a subset of each site's datasets, use a separate --output folder")
+        if not getattr(args, "no_lists", False) and args.lists_output == parser.get_default("lists_output"):
+            parser.error("--marker only builds a subset of each site's datasets, use a separate --lists-output folder" + (" or --no-lists" if args.command == "build" else ""))
+
+    return args
+
+
+def create_builder(args, list_generator=None):
+    from ednaresults.builder import OccurrenceBuilder
+
+    return OccurrenceBuilder(
+        pipeline_data_path=args.pipeline_data,
+        output_folder=args.output,
+        state_folder=args.state,
+        list_generator=list_generator,
+        sync_results=getattr(args, "sync", False),
+        results_source=getattr(args, "source", None),
+        resume=getattr(args, "resume", False),
+        pipelined=getattr(args, "pipelined", False),
+        combined_database=getattr(args, "combined_database", None),
+        sample_id_mapping_file=getattr(args, "sample_id_mapping", None),
+        dataset_names_file=args.dataset_names,
+        compression=args.compression,
+        archive=args.sites is None and args.markers is None,
+        sites=args.sites,
+        markers=args.markers,
+        rescan=args.rescan
+    )
+
+
+def create_list_generator(args):
+    from ednaresults.lists import ListGenerator
+
+    return ListGenerator(
+        output_folder=args.lists_output,
+        compression=args.compression,
+        archive=args.sites is None and args.markers is None
+    )
+
+
+def dry_run(builder):
+    for site_name, folders in builder.plan().items():
+        print(site_name)
+        for folder in folders:
+            print(f"  {folder}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s", level=args.log_level.upper())
+
+    if args.command == "sync":
+        from ednaresults.builder import OccurrenceBuilder
+        OccurrenceBuilder(pipeline_data_path=args.pipeline_data, results_source=args.source).download_results()
+
+    elif args.command == "build":
+        if (args.sites is not None or args.markers is not None) and args.combined_database is not None:
+            raise SystemExit("--combined-database can not be combined with --site or --marker, the database would only contain the selected datasets")
+        if args.dry_run:
+            dry_run(create_builder(args))
+            return
+        list_generator = None if args.no_lists else create_list_generator(args)
+        create_builder(args, list_generator).build()
+
+    elif args.command == "lists":
+        if args.dry_run:
+            dry_run(create_builder(args))
+            return
+        create_builder(args, create_list_generator(args)).generate_lists()
+
+    elif args.command == "upload":
+        from ednaresults.upload import upload_lists, upload_results
+        upload_results(args.output)
+        if not args.no_lists:
+            upload_lists(args.lists_output)
+
+
+if __name__ == "__main__":
+    main()